@@ -0,0 +1,108 @@
+import os
+import hashlib
+import logging
+from typing import List, Optional
+from diskcache import Cache as DiskCache
+from .ImageBlob import ImageBlob
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = "~/.cache/markpdfdown"
+# Maximum number of perceptual hashes kept per index bucket, the oldest are dropped first
+MAX_BUCKET_ENTRIES = 64
+
+class Cache:
+    """
+    Response cache for image to Markdown conversion
+    """
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR, phash_distance: Optional[int] = None):
+        """
+        Initialize cache
+
+        Args:
+            directory (str): Cache directory on disk
+            phash_distance (int, optional): Maximum Hamming distance between perceptual hashes
+                for two images to be considered the same page, disabled when None
+        """
+        self.store = DiskCache(os.path.expanduser(directory))
+        self.phash_distance = phash_distance
+        if phash_distance is not None:
+            try:
+                import imagehash  # noqa: F401
+            except ImportError:
+                logger.warning("imagehash is not installed, similar image matching is disabled")
+                self.phash_distance = None
+
+    @staticmethod
+    def make_key(image: ImageBlob, prompt: str, model: str) -> str:
+        """
+        Build exact cache key from image content, prompt and model
+
+        Args:
+            image (ImageBlob): Image
+            prompt (str): User prompt
+            model (str): Model name
+
+        Returns:
+            str: SHA-256 hex digest
+        """
+        return hashlib.sha256(image.sha256.encode() + prompt.encode() + model.encode()).hexdigest()
+
+    def _bucket_keys(self, phash: str, prompt: str, model: str) -> List[str]:
+        # The perceptual hash index is split into buckets mapping perceptual hash (hex) to exact cache key,
+        # one per segment value of the hash. The hash is split into phash_distance + 1 segments, so a hash
+        # within phash_distance differs in at most phash_distance segments and shares a bucket with the other
+        scope = hashlib.sha256(prompt.encode() + model.encode()).hexdigest()
+        value = int(phash, 16)
+        bits = len(phash) * 4
+        count = min(self.phash_distance + 1, bits)
+        keys = []
+        for i in range(count):
+            start, end = bits * i // count, bits * (i + 1) // count
+            segment = (value >> start) & ((1 << (end - start)) - 1)
+            keys.append(f"phash:{scope}:{i}:{segment:x}")
+        return keys
+
+    def get(self, image: ImageBlob, prompt: str, model: str) -> Optional[str]:
+        """
+        Look up cached response, exact match first and then similar image match
+
+        Returns:
+            str: Cached response, None on miss
+        """
+        key = self.make_key(image, prompt, model)
+        response = self.store.get(key)
+        if response is not None:
+            logger.info("Cache hit for image %s", image.path)
+            return response
+
+        # The perceptual hash is computed with the image, see ImageBlob.from_path
+        if self.phash_distance is None or image.phash is None:
+            return None
+        phash = str(image.phash)
+        for bucket_key in self._bucket_keys(phash, prompt, model):
+            for other, other_key in self.store.get(bucket_key, {}).items():
+                if bin(int(phash, 16) ^ int(other, 16)).count("1") <= self.phash_distance:
+                    # The response may have been evicted while the bucket was kept
+                    response = self.store.get(other_key)
+                    if response is not None:
+                        logger.info("Similar image cache hit for image %s", image.path)
+                        return response
+        return None
+
+    def set(self, image: ImageBlob, prompt: str, model: str, response: str):
+        """
+        Store response for the image
+        """
+        key = self.make_key(image, prompt, model)
+        self.store.set(key, response)
+        if self.phash_distance is not None and image.phash is not None:
+            phash = str(image.phash)
+            for bucket_key in self._bucket_keys(phash, prompt, model):
+                with self.store.transact():
+                    bucket = self.store.get(bucket_key, {})
+                    bucket.pop(phash, None)
+                    bucket[phash] = key
+                    while len(bucket) > MAX_BUCKET_ENTRIES:
+                        del bucket[next(iter(bucket))]
+                    self.store.set(bucket_key, bucket)
@@ -1,6 +1,7 @@
 import os
 import logging
-from typing import List
+from typing import Iterator, List, Optional
+from .Util import natural_sort_key
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +17,8 @@ class FileWorker:
             input_path (str): Input file path
         """
         self.input_path = input_path
+        # Number of the first converted page in the input file
+        self.first_page = 1
         
     def convert_to_images(self, output_dir: str = ".", **kwargs) -> List[str]:
         """
@@ -30,6 +33,20 @@ class FileWorker:
         """
         raise NotImplementedError("Subclasses must implement this method")
 
+    def iter_pages(self, **kwargs) -> Iterator[Optional[str]]:
+        """
+        Convert input file to images, yielding each image path as soon as it is generated.
+        Subclasses rendering page by page should override it, the default implementation
+        yields the paths from convert_to_images in page order
+
+        Args:
+            **kwargs: Parameters passed to convert_to_images
+
+        Yields:
+            str: Generated image path, None for a page that failed to render
+        """
+        yield from sorted(self.convert_to_images(**kwargs), key=natural_sort_key)
+
 def create_worker(input_path: str, start_page: int = 1, end_page: int = 0):
     """
     Create corresponding Worker instance based on file extension
@@ -0,0 +1,80 @@
+import os
+import hashlib
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Long edge limit of images sent to the model, larger images are resized by the provider anyway (GPT-4o high detail)
+MAX_IMAGE_EDGE = 1568
+JPEG_QUALITY = 85
+
+def resize_image(image_path: str) -> str:
+    """
+    Downscale image to fit MAX_IMAGE_EDGE and recompress it as JPEG next to the image
+
+    Args:
+        image_path (str): Path to the image
+
+    Returns:
+        str: Path to the resized image
+    """
+    import fitz  # PyMuPDF
+    resized_path = f"{os.path.splitext(image_path)[0]}_{MAX_IMAGE_EDGE}.jpg"
+    pix = fitz.Pixmap(image_path)
+    scale = MAX_IMAGE_EDGE / max(pix.width, pix.height)
+    if scale < 1:
+        pix = fitz.Pixmap(pix, round(pix.width * scale), round(pix.height * scale))
+    # JPEG supports neither alpha channel nor every colorspace
+    if pix.alpha:
+        pix = fitz.Pixmap(pix, 0)
+    if pix.colorspace.n not in (1, 3):
+        pix = fitz.Pixmap(fitz.csRGB, pix)
+    pix.save(resized_path, jpg_quality=JPEG_QUALITY)
+    return resized_path
+
+@dataclass
+class ImageBlob:
+    """
+    Page image with its content hashes and the resized image sent to the model,
+    computed once and shared by cache lookup, logging and the request
+    """
+    path: str
+    sha256: str
+    # Resized image sent to the model, the original image when not resized
+    upload_path: Optional[str] = None
+    # Perceptual hash for similar image cache matching, None when not computed
+    phash: Optional[object] = None
+
+    @classmethod
+    def from_path(cls, path: str, resize: bool = False, phash: bool = False) -> "ImageBlob":
+        """
+        Read image file once in chunks and hash its content
+
+        Args:
+            path (str): Path to the image
+            resize (bool): Whether to prepare the resized image sent to the model,
+                the original image is sent when resizing fails
+            phash (bool): Whether to compute the perceptual hash, requires imagehash
+
+        Returns:
+            ImageBlob: Image blob
+        """
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha.update(chunk)
+        upload_path = path
+        if resize:
+            try:
+                upload_path = resize_image(path)
+            except Exception as e:
+                logger.warning("Failed to resize image %s, sending the original image: %s", path, e)
+        image_phash = None
+        if phash:
+            import imagehash
+            from PIL import Image
+            with Image.open(path) as pil_image:
+                image_phash = imagehash.phash(pil_image)
+        return cls(path=path, sha256=sha.hexdigest(), upload_path=upload_path, phash=image_phash)
@@ -1,9 +1,56 @@
+import time
+import base64
 import logging
+import httpx
 import openai
+import orjson
 from typing import List, Dict, Optional
+from tenacity import AsyncRetrying, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
 
 logger = logging.getLogger(__name__)
 
+# Transient errors worth retrying, other errors (e.g. authentication, bad request) fail immediately
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+)
+
+# Upper bound of the wait between attempts, also applied to Retry-After
+MAX_RETRY_WAIT = 30
+
+_backoff = wait_exponential_jitter(initial=1, max=MAX_RETRY_WAIT)
+
+def wait_retry_after(retry_state) -> float:
+    """
+    Exponential backoff with jitter, honoring the Retry-After header of rate limit errors up to MAX_RETRY_WAIT
+    """
+    wait = _backoff(retry_state)
+    error = retry_state.outcome.exception()
+    if isinstance(error, openai.RateLimitError):
+        try:
+            wait = max(wait, min(float(error.response.headers.get("retry-after")), MAX_RETRY_WAIT))
+        except (TypeError, ValueError):
+            pass
+    return wait
+
+def log_retry(retry_state):
+    logger.warning("API request failed, retrying in %.1fs: %s", retry_state.next_action.sleep, retry_state.outcome.exception())
+
+class OrjsonAsyncHttpxClient(openai.DefaultAsyncHttpxClient):
+    """
+    HTTP client serializing JSON request bodies with orjson, which is much faster
+    than the json module for large base64 image payloads
+    """
+    def build_request(self, method, url, *, content=None, json=None, headers=None, **kwargs) -> httpx.Request:
+        if json is not None:
+            content = orjson.dumps(json)
+            json = None
+            headers = httpx.Headers(headers)
+            headers["Content-Type"] = "application/json"
+        return super().build_request(method, url, content=content, json=json, headers=headers, **kwargs)
+
 class LLMClient:
     """
     OpenAI API compatible client class
@@ -18,18 +65,33 @@ class LLMClient:
         self.base_url = base_url
         self.api_key = api_key
         self.model = model
-        self.client = openai.OpenAI(
+        # OpenRouter uses these headers for app attribution
+        self.extra_headers = {
+            "X-Title": "MarkPDFdown",
+            "HTTP-Referer": "https://github.com/jorben/markpdfdown",
+        } if "openrouter.ai" in base_url.lower() else None
+        # Share a keep-alive HTTP/2 connection pool across all requests
+        self.client = openai.AsyncOpenAI(
                 base_url=base_url,
-                api_key=api_key
+                api_key=api_key,
+                # Retries are handled in completion
+                max_retries=0,
+                http_client=OrjsonAsyncHttpxClient(
+                    limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+                    http2=True
+                )
             )
         
-    def completion(
+    async def completion(
         self,
         user_message: str,
         system_prompt: Optional[str] = None,
         image_paths: Optional[List[str]] = None,
         temperature: float = 0.7,
-        max_tokens: int = 8192
+        max_tokens: int = 8192,
+        retry_times: int = 3,
+        timeout: float = 120,
+        deadline: Optional[float] = None
     ) -> str:
         """
         Create chat dialogue (supports multimodal)
@@ -40,6 +102,9 @@ class LLMClient:
             image_paths: List of image paths (optional)
             temperature: Generation temperature
             max_tokens: Maximum number of tokens
+            retry_times: Maximum number of attempts on transient errors
+            timeout: Timeout of each attempt in seconds
+            deadline: time.monotonic() value after which no more attempts are made (optional)
             
         Returns:
             str: Model generated response content
@@ -52,42 +117,69 @@ class LLMClient:
                 user_content.append({
                     "type": "image_url",
                     "image_url": {
-                        "url": f"data:image/jpeg;base64,{base64_image}"
+                        "url": f"data:image/jpeg;base64,{base64_image}",
+                        "detail": "high"
                     }
                 })
 
-        messages = [
-            {"role": "system", "content": system_prompt or ""},
-            {"role": "user", "content": user_content}
-        ]
+        messages = [{"role": "user", "content": user_content}]
+        # Only send system message when there is a system prompt
+        if system_prompt:
+            messages.insert(0, {"role": "system", "content": system_prompt})
         
+        wait = wait_retry_after
+        if deadline is not None:
+            # Never sleep past the deadline, the next attempt then fails fast
+            wait = lambda retry_state: max(0, min(wait_retry_after(retry_state), deadline - time.monotonic()))
+
         try:
             response = None
-            if "openrouter.ai" in str(self.base_url).lower():
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=messages,
-                    temperature=temperature,
-                    max_tokens=max_tokens,
-                    extra_headers={
-                        "X-Title": "MarkPDFdown",
-                        "HTTP-Referer": "https://github.com/jorben/markpdfdown",
-                        },
-                    )
-            else:
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=messages,
-                    temperature=temperature,
-                    max_tokens=max_tokens
-                    )
+            async for attempt in AsyncRetrying(
+                retry=retry_if_exception_type(RETRYABLE_ERRORS),
+                wait=wait,
+                stop=stop_after_attempt(retry_times),
+                before_sleep=log_retry,
+                reraise=True
+            ):
+                with attempt:
+                    request_timeout = timeout
+                    if deadline is not None:
+                        request_timeout = min(timeout, deadline - time.monotonic())
+                        if request_timeout <= 0:
+                            raise TimeoutError("Deadline exceeded")
+                    response = await self.client.chat.completions.create(
+                        model=self.model,
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        extra_headers=self.extra_headers,
+                        timeout=request_timeout
+                        )
             return response.choices[0].message.content
             
         except Exception as e:
             logger.error(f"API request failed: {str(e)}")
             raise e
+
+    async def close(self):
+        """
+        Close the connection pool of the client
+        """
+        await self.client.close()
     
     def encode_image(self, image_path: str) -> str:
-        import base64
+        """
+        Encode image file to base64 in chunks to avoid holding the raw file in memory
+
+        Args:
+            image_path: Path to the image
+
+        Returns:
+            str: Base64 encoded image
+        """
+        encoded = bytearray()
         with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
\ No newline at end of file
+            # Chunk size must be a multiple of 3 so chunks encode without padding
+            while chunk := image_file.read(57 * 1024):
+                encoded += base64.b64encode(chunk)
+        return encoded.decode('ascii')
\ No newline at end of file
@@ -1,7 +1,7 @@
 import os
 import logging
 import PyPDF2
-from typing import List
+from typing import Iterator, List, Optional
 from .FileWorker import FileWorker
 
 logger = logging.getLogger(__name__)
@@ -17,6 +17,8 @@ class PDFWorker(FileWorker):
         self.start_page = start_page
         self.end_page = end_page
         self.output_dir = os.path.dirname(input_path)
+        # Number of pages to convert
+        self.page_count = self.total_pages
 
         # First validate page number range
         if start_page < 1 or start_page > self.total_pages:
@@ -38,6 +40,8 @@ class PDFWorker(FileWorker):
             
         logger.info("Page extraction completed")
         self.input_path = extracted_path
+        self.first_page = min(start_page, end_page)
+        self.page_count = abs(end_page - start_page) + 1
 
     def get_total_pages(self) -> int:
         """
@@ -104,21 +108,38 @@ class PDFWorker(FileWorker):
         Returns:
             List[str]: List of generated image paths
         """
+        return [path for path in self.iter_pages(dpi, fmt) if path is not None]
+
+    def iter_pages(self, dpi: int = 300, fmt: str = 'jpg') -> Iterator[Optional[str]]:
+        """
+        Convert PDF pages to high-quality images one by one
+        
+        Args:
+            dpi (int): Output image resolution (default 300)
+            fmt (str): Image format (supports jpg/png, default jpg)
+            
+        Yields:
+            str: Generated image path, None for a page that failed to render
+        """
         try:
             import fitz  # PyMuPDF
             os.makedirs(self.output_dir, exist_ok=True)
-            img_paths = []
-
             doc = fitz.open(self.input_path)
-            for page_num in range(len(doc)):
+            page_count = len(doc)
+        except Exception as e:
+            logger.error(f"PDF conversion to images failed: {str(e)}")
+            # Report every page as failed rather than silently producing no output
+            yield from [None] * self.page_count
+            return
+
+        for page_num in range(page_count):
+            try:
                 page = doc.load_page(page_num)
                 pix = page.get_pixmap(dpi=dpi)
                 output_path = os.path.join(self.output_dir, f"page_{page_num+1:04d}.{fmt}")
                 pix.save(output_path)
-                img_paths.append(output_path)
-            
-            return img_paths
-            
-        except Exception as e:
-            logger.error(f"PDF conversion to images failed: {str(e)}")
-            return []
\ No newline at end of file
+            except Exception as e:
+                logger.error(f"Page {self.first_page + page_num} conversion to image failed: {str(e)}")
+                yield None
+                continue
+            yield output_path
@@ -1,3 +1,6 @@
+import os
+import re
+
 def remove_markdown_warp(text, language="markdown"):
     """
     Remove the warp of ```language and ```
@@ -10,3 +13,43 @@ def remove_markdown_warp(text, language="markdown"):
     return text.strip()
 
 
+
+# File magic numbers/signatures mapped to extension and type name
+FILE_SIGNATURES = {
+    b'%PDF-': ('.pdf', 'PDF'),
+    b'\xFF\xD8\xFF': ('.jpg', 'JPEG'),
+    b'\x89\x50\x4E\x47': ('.png', 'PNG'),
+    b'\x42\x4D': ('.bmp', 'BMP'),
+}
+
+def detect_file_type(header):
+    """
+    Detect file type by the leading bytes of the file content
+    Returns (extension, type name), or (None, None) when unsupported
+    """
+    for signature, file_type in FILE_SIGNATURES.items():
+        if header.startswith(signature):
+            return file_type
+    return None, None
+
+def split_batch_markdown(text, count):
+    """
+    Split the response of a batch request into pages wrapped by <page i> and </page i>
+    Returns list of page contents, None for each page missing or cut off
+    """
+    pages = []
+    for i in range(1, count + 1):
+        start_tag, end_tag = f"<page {i}>", f"</page {i}>"
+        start = text.find(start_tag)
+        end = text.find(end_tag, start)
+        if start == -1 or end == -1:
+            pages.append(None)
+        else:
+            pages.append(text[start + len(start_tag):end].strip())
+    return pages
+
+def natural_sort_key(path):
+    """
+    Sort key ordering numbers in file names by value, e.g. page-2 before page-10
+    """
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', os.path.basename(path))]
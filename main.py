@@ -1,9 +1,13 @@
 import os
 import sys
 import time
+import asyncio
 import shutil
 import logging
+import concurrent.futures
 from core import LLMClient
+from core.Cache import Cache
+from core.ImageBlob import ImageBlob
 from core.FileWorker import create_worker
 from core.Util import *
 
@@ -16,7 +20,33 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def completion(message, model="", system_prompt="", image_paths=None, temperature=0.5, max_tokens=8192, retry_times=3):
+# Response cache, None when caching is disabled
+response_cache = None
+
+# Marker of a page that could not be rendered or prepared, written as a failed page placeholder
+FAILED_PAGE = object()
+
+# LLMClient per event loop and configuration, their connection pools are bound to the event loop
+clients = {}
+
+def get_client(base_url, api_key, model):
+    """
+    Get LLMClient for the given configuration, reusing its connection pool across calls on the running event loop
+    """
+    key = (asyncio.get_running_loop(), base_url, api_key, model)
+    if key not in clients:
+        clients[key] = LLMClient.LLMClient(base_url=base_url, api_key=api_key, model=model)
+    return clients[key]
+
+async def close_clients():
+    """
+    Close the LLMClients created on the running event loop
+    """
+    loop = asyncio.get_running_loop()
+    for key in [key for key in clients if key[0] is loop]:
+        await clients.pop(key).close()
+
+async def completion(message, model="", system_prompt="", image_paths=None, temperature=0.5, max_tokens=8192, retry_times=3, deadline=None, semaphore=None):
     """
     Call OpenAI's completion interface for text generation
 
@@ -27,8 +57,11 @@ def completion(message, model="", system_prompt="", image_paths=None, temperatur
         image_paths (List[str], optional): List of image paths, defaults to None
         temperature (float, optional): Temperature for text generation, defaults to 0.5
         max_tokens (int, optional): Maximum number of tokens for generated text, defaults to 8192
+        retry_times (int, optional): Maximum number of attempts on transient errors, defaults to 3
+        deadline (float, optional): time.monotonic() value after which no more attempts are made, defaults to None
+        semaphore (asyncio.Semaphore, optional): Semaphore limiting the number of in-flight requests, defaults to None
     Returns:
-        str: Generated text content
+        str: Generated text content, None on failure
     """
     
     # Get API key and API base URL from environment variables
@@ -47,87 +80,262 @@ def completion(message, model="", system_prompt="", image_paths=None, temperatur
             model = "gpt-4o"
 
     # Initialize LLMClient
-    client = LLMClient.LLMClient(base_url=base_url, api_key=api_key, model=model)
-    # Call completion method with retry mechanism
-    for _ in range(retry_times):
-        try:
-            response = client.completion(user_message=message, system_prompt=system_prompt, image_paths=image_paths, temperature=temperature, max_tokens=max_tokens)
-            return response
-        except Exception as e:
-            logger.error(f"LLM call failed: {str(e)}")
-            # If retry fails, wait for a while before retrying
-            time.sleep(0.5)
-    return ""
+    client = get_client(base_url, api_key, model)
+    # Call completion method, transient errors are retried by the client
+    if semaphore is not None:
+        await semaphore.acquire()
+    try:
+        return await client.completion(user_message=message, system_prompt=system_prompt, image_paths=image_paths, temperature=temperature, max_tokens=max_tokens, retry_times=retry_times, timeout=float(os.getenv("MARKPDF_TIMEOUT", "120")), deadline=deadline)
+    except Exception as e:
+        logger.error(f"LLM call failed: {str(e)}")
+    finally:
+        if semaphore is not None:
+            semaphore.release()
+    return None
 
-def convert_image_to_markdown(image_path):
-    """
-    Convert image to Markdown format
-    Args:
-        image_path (str): Path to the image
-    Returns:
-        str: Converted Markdown string
-    """
-    user_prompt = """
+USER_PROMPT_IMG2MD = """
 Please read the content in the image and transcribe it into plain Markdown format. Please note:
 1. Maintain the format of headings, text, formulas, and table rows and columns
 2. Mathematical formulas should be transcribed using LaTeX syntax, ensuring consistency with the original
 3. No additional explanation is needed, and no content outside the original text should be added.
     """
-    
-    response = completion(message=user_prompt, model="", image_paths=[image_path], temperature=0.3, max_tokens=8192)
-    response = remove_markdown_warp(response, "markdown")
-    return response
+
+# Rough upper bound of tokens billed per image after the provider resizes it (GPT-4o high detail)
+IMAGE_TOKENS = 1105
+# Maximum number of tokens generated for a single page
+PAGE_MAX_TOKENS = 8192
+
+def get_max_tokens(count):
+    """
+    Get maximum number of generated tokens for a request converting count images,
+    scaled with the number of images and capped by the model output limit
+    Args:
+        count (int): Number of images
+    Returns:
+        int: Maximum number of tokens
+    """
+    return min(PAGE_MAX_TOKENS * count, int(os.getenv("MARKPDF_MAX_OUTPUT_TOKENS", "16384")))
+
+def get_batch_size():
+    """
+    Get number of images sent in a single request, shrunk to fit the model context
+    Returns:
+        int: Batch size
+    """
+    batch_size = int(os.getenv("MARKPDF_BATCH_SIZE", "4"))
+    max_context = int(os.getenv("MARKPDF_MAX_CONTEXT", "128000"))
+    # Estimate about 4 characters per prompt token
+    prompt_tokens = len(USER_PROMPT_IMG2MD) // 4
+    while batch_size > 1 and prompt_tokens + batch_size * IMAGE_TOKENS + get_max_tokens(batch_size) > max_context:
+        batch_size -= 1
+    return max(1, batch_size)
+
+async def convert_image_to_markdown(images, deadline=None, semaphore=None):
+    """
+    Convert images to Markdown format, sending all images not yet cached in a single request
+    Args:
+        images (List[ImageBlob]): Images
+        deadline (float, optional): time.monotonic() value after which no more attempts are made
+        semaphore (asyncio.Semaphore, optional): Semaphore limiting the number of in-flight requests
+    Returns:
+        List[str]: Converted Markdown strings, one per image, None for failed images
+    """
+    model = os.getenv("OPENAI_DEFAULT_MODEL") or "gpt-4o"
+    results = {}
+    pending = []
+    for image in images:
+        response = response_cache.get(image, USER_PROMPT_IMG2MD, model) if response_cache is not None else None
+        if response is not None:
+            results[image.path] = response
+        else:
+            pending.append(image)
+    if not pending:
+        return [results[image.path] for image in images]
+
+    # Images to convert one by one because they are missing from the batch response
+    missing = []
+    if len(pending) == 1:
+        response = await completion(message=USER_PROMPT_IMG2MD, model=model, image_paths=[image.upload_path for image in pending], temperature=0.3, max_tokens=get_max_tokens(1), deadline=deadline, semaphore=semaphore)
+        pages = [response]
+    else:
+        batch_prompt = USER_PROMPT_IMG2MD + f"""4. There are {len(pending)} images, transcribe each of them separately and wrap the Markdown of the i-th image between <page i> and </page i>, e.g. <page 1>...</page 1>
+    """
+        response = await completion(message=batch_prompt, model=model, image_paths=[image.upload_path for image in pending], temperature=0.3, max_tokens=get_max_tokens(len(pending)), deadline=deadline, semaphore=semaphore)
+        if response is None:
+            pages = [None] * len(pending)
+        else:
+            pages = split_batch_markdown(response, len(pending))
+            missing = [image for image, page in zip(pending, pages) if page is None]
+
+    for image, page in zip(pending, pages):
+        if page is None:
+            results[image.path] = None
+            continue
+        results[image.path] = remove_markdown_warp(page, "markdown")
+        # Only successful conversions are cached, including blank pages
+        if response_cache is not None:
+            response_cache.set(image, USER_PROMPT_IMG2MD, model, results[image.path])
+
+    if missing:
+        # The reply was cut off or did not follow the page delimiters, keep the pages that were split
+        logger.warning("Failed to split %d of %d pages from batch response, converting them separately", len(missing), len(pending))
+        converted = await asyncio.gather(*[convert_image_to_markdown([image], deadline, semaphore) for image in missing])
+        results.update((image.path, markdown[0]) for image, markdown in zip(missing, converted))
+    return [results[image.path] for image in images]
+
+async def convert_pages_to_markdown(worker, output):
+    """
+    Convert pages to images and images to Markdown in a pipeline,
+    batches are converted as soon as their images are rendered
+    and written to output in page order as soon as they are converted
+    Args:
+        worker (FileWorker): Worker of the input file
+        output (TextIO): Stream the Markdown is written to
+    Returns:
+        int: Number of converted pages
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    tasks = asyncio.Queue()
+    # Limit the number of in-flight LLM requests, acquired per request so batch fallbacks count too
+    semaphore = asyncio.Semaphore(int(os.getenv("MARKPDF_CONCURRENCY", "8")))
+    batch_size = get_batch_size()
+    # Time budget for the whole document, unlimited when not set
+    total_timeout = os.getenv("MARKPDF_TOTAL_TIMEOUT")
+    deadline = time.monotonic() + float(total_timeout) if total_timeout else None
+
+    # Perceptual hashes are only needed for similar image cache matching
+    phash = response_cache is not None and response_cache.phash_distance is not None
+
+    def render():
+        # Runs in the render thread, None marks the end of pages
+        try:
+            for img_path in worker.iter_pages():
+                if img_path is None:
+                    loop.call_soon_threadsafe(queue.put_nowait, FAILED_PAGE)
+                    continue
+                # Hash and resize each image once, off the event loop
+                try:
+                    image = ImageBlob.from_path(img_path.replace("\\", "/"), resize=True, phash=phash)
+                except Exception as e:
+                    logger.error("Failed to prepare image %s: %s", img_path, e)
+                    image = FAILED_PAGE
+                loop.call_soon_threadsafe(queue.put_nowait, image)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, None)
+
+    async def convert_batch(batch):
+        images = [image for image in batch if image is not FAILED_PAGE]
+        if not images:
+            return [None] * len(batch)
+        logger.info("Converting images %s to Markdown", ", ".join(image.path for image in images))
+        pages = iter(await convert_image_to_markdown(images, deadline, semaphore))
+        return [None if image is FAILED_PAGE else next(pages) for image in batch]
+
+    async def write_pages():
+        # Tasks are queued in page order, None marks the end of tasks
+        page_num = worker.first_page - 1
+        while (item := await tasks.get()) is not None:
+            task, count = item
+            try:
+                pages = await task
+            except Exception as e:
+                # Keep writing the remaining batches, the pages of this batch become placeholders
+                logger.error("Failed to convert batch of %d pages: %s", count, e)
+                pages = [None] * count
+            for page in pages:
+                page_num += 1
+                # Keep a placeholder for failed pages so the remaining pages are still output
+                if page is None:
+                    logger.error("Failed to convert page %d to Markdown", page_num)
+                    page = f"<!-- page {page_num} failed -->"
+                output.write(page)
+                output.write("\n\n")
+                output.flush()
+        return page_num - worker.first_page + 1
+
+    # PyMuPDF is not thread safe, all rendering and resizing happens in this single thread
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    renderer = loop.run_in_executor(executor, render)
+    writer = asyncio.create_task(write_pages())
+    batch_tasks = []
+
+    def dispatch(batch):
+        task = asyncio.create_task(convert_batch(batch))
+        batch_tasks.append(task)
+        tasks.put_nowait((task, len(batch)))
+
+    try:
+        batch = []
+        while (image := await queue.get()) is not None:
+            batch.append(image)
+            if len(batch) == batch_size:
+                dispatch(batch)
+                batch = []
+        if batch:
+            dispatch(batch)
+        tasks.put_nowait(None)
+        page_count = await writer
+        # Render errors are raised once the pages rendered before them are written
+        await renderer
+        logger.info("Image conversion completed")
+        return page_count
+    finally:
+        # Stop outstanding LLM requests when the pipeline is aborted, no-op for finished tasks
+        for task in batch_tasks + [writer]:
+            task.cancel()
+        # Let cancelled requests unwind before their connections are closed
+        await asyncio.gather(*batch_tasks, writer, return_exceptions=True)
+        executor.shutdown(wait=False)
+        await close_clients()
 
 if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if arg != "--no-cache"]
     start_page = 1
     end_page = 0
-    if len(sys.argv) > 2:
-        start_page = int(sys.argv[1])
-        end_page = int(sys.argv[2])
-    elif len(sys.argv) > 1:
+    if len(args) > 1:
+        start_page = int(args[0])
+        end_page = int(args[1])
+    elif len(args) > 0:
         start_page = 1
-        end_page = int(sys.argv[1])
+        end_page = int(args[0])
 
-    # Read binary data from standard input
-    input_data = sys.stdin.buffer.read()
-    if not input_data:
-        logger.error("No input data received")
-        logger.error("Usage: python main.py [start_page] [end_page] < path_to_input.pdf")
-        exit(1)
+    if "--no-cache" not in sys.argv:
+        phash_distance = os.getenv("MARKPDF_CACHE_PHASH_DISTANCE")
+        response_cache = Cache(phash_distance=int(phash_distance) if phash_distance else None)
 
     # Create output directory
     output_dir = f"output/{time.strftime('%Y%m%d%H%M%S')}"
     os.makedirs(output_dir, exist_ok=True)
 
+    # Stream binary data from standard input to disk, keeping the header for type detection
+    input_path = os.path.join(output_dir, "input.bin")
+    with open(input_path, "wb") as f:
+        header = sys.stdin.buffer.read(8)
+        f.write(header)
+        shutil.copyfileobj(sys.stdin.buffer, f, 1 << 20)
+    if not header:
+        logger.error("No input data received")
+        logger.error("Usage: python main.py [start_page] [end_page] [--no-cache] < path_to_input.pdf")
+        shutil.rmtree(output_dir)
+        exit(1)
+
     # Try to get extension from file name
     input_filename = os.path.basename(sys.stdin.buffer.name)
     input_ext = os.path.splitext(input_filename)[1]
     
     # If there is no extension or the file comes from standard input, try to determine the type by file content
     if not input_ext or input_filename == '<stdin>':
-        # PDF file magic number/signature is %PDF-
-        if input_data.startswith(b'%PDF-'):
-            input_ext = '.pdf'
-            logger.info("Recognized as PDF file by file content")
-        # JPEG file magic number/signature is FF D8 FF DB
-        elif input_data.startswith(b'\xFF\xD8\xFF\xDB'):
-            input_ext = '.jpg'
-            logger.info("Recognized as JPEG file by file content")
-        # PNG file magic number/signature is 89 50 4E 47
-        elif input_data.startswith(b'\x89\x50\x4E\x47'):
-            input_ext = '.png'
-            logger.info("Recognized as PNG file by file content")
-        # BMP file magic number/signature is 42 4D
-        elif input_data.startswith(b'\x42\x4D'):
-            input_ext = '.bmp'
-            logger.info("Recognized as BMP file by file content")
-        else:
+        input_ext, file_type = detect_file_type(header)
+        if not input_ext:
             logger.error("Unsupported file type")
+            shutil.rmtree(output_dir)
             exit(1)
+        logger.info("Recognized as %s file by file content", file_type)
     
-    input_path = os.path.join(output_dir, f"input{input_ext}")
-    with open(input_path, "wb") as f:
-        f.write(input_data)
+    renamed_path = os.path.join(output_dir, f"input{input_ext}")
+    os.rename(input_path, renamed_path)
+    input_path = renamed_path
 
     # create file worker
     try:
@@ -136,20 +344,9 @@ if __name__ == "__main__":
         logger.error(str(e))
         exit(1)
     
-    # convert to images
-    img_paths = worker.convert_to_images()
-    logger.info("Image conversion completed")
-
-    # convert to markdown
-    markdown = ""
-    for img_path in sorted(img_paths):
-        img_path = img_path.replace("\\", "/")
-        logger.info("Converting image %s to Markdown", img_path)
-        markdown += convert_image_to_markdown(img_path)
-        markdown += "\n\n"
+    # convert to images and markdown, writing Markdown to standard output as pages complete
+    asyncio.run(convert_pages_to_markdown(worker, sys.stdout))
     logger.info("Image conversion to Markdown completed")
-    # Output Markdown
-    print(markdown)
     # Remote output path
     shutil.rmtree(output_dir)
     exit(0)
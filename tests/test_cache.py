@@ -0,0 +1,49 @@
+import pytest
+from core.Cache import Cache
+from core.ImageBlob import ImageBlob
+
+def test_cache(tmp_path):
+    image_path = tmp_path / "page_0001.jpg"
+    image_path.write_bytes(b"\xFF\xD8\xFF\xDB page")
+    image = ImageBlob.from_path(str(image_path))
+    cache = Cache(directory=str(tmp_path / "cache"))
+    assert cache.get(image, "prompt", "gpt-4o") is None
+    cache.set(image, "prompt", "gpt-4o", "# Hello, world!")
+    assert cache.get(image, "prompt", "gpt-4o") == "# Hello, world!"
+    assert cache.get(image, "another prompt", "gpt-4o") is None
+    assert cache.get(image, "prompt", "another-model") is None
+    image_path.write_bytes(b"\xFF\xD8\xFF\xDB another page")
+    assert cache.get(ImageBlob.from_path(str(image_path)), "prompt", "gpt-4o") is None
+
+def test_cache_similar_image(tmp_path):
+    pytest.importorskip("imagehash")
+    from PIL import Image, ImageDraw
+    image_paths = []
+    for i, text in enumerate(["Hello, world!", "Hello, world?"]):
+        pil_image = Image.new("RGB", (400, 200), "white")
+        ImageDraw.Draw(pil_image).text((100, 90), text, fill="black")
+        image_path = tmp_path / f"page_{i + 1:04d}.png"
+        pil_image.save(image_path)
+        image_paths.append(str(image_path))
+    cache = Cache(directory=str(tmp_path / "cache"), phash_distance=4)
+    cache.set(ImageBlob.from_path(image_paths[0], phash=True), "prompt", "gpt-4o", "# Hello, world!")
+    # The index is persisted, so a new cache instance finds near-duplicates stored earlier
+    cache = Cache(directory=str(tmp_path / "cache"), phash_distance=4)
+    assert cache.get(ImageBlob.from_path(image_paths[1], phash=True), "prompt", "gpt-4o") == "# Hello, world!"
+    assert cache.get(ImageBlob.from_path(image_paths[1], phash=True), "another prompt", "gpt-4o") is None
+    # Without a perceptual hash only exact matches are found
+    assert cache.get(ImageBlob.from_path(image_paths[1]), "prompt", "gpt-4o") is None
+
+def test_cache_phash_index(tmp_path, monkeypatch):
+    monkeypatch.setattr("core.Cache.MAX_BUCKET_ENTRIES", 2)
+    cache = Cache(directory=str(tmp_path / "cache"), phash_distance=4)
+    # Perceptual hashes are given directly, imagehash is not needed
+    cache.phash_distance = 4
+    cache.set(ImageBlob(path="a.jpg", sha256="a", phash="0000000000000000"), "prompt", "gpt-4o", "# A")
+    assert cache.get(ImageBlob(path="b.jpg", sha256="b", phash="000000000000000f"), "prompt", "gpt-4o") == "# A"
+    assert cache.get(ImageBlob(path="c.jpg", sha256="c", phash="00000000000000ff"), "prompt", "gpt-4o") is None
+    # Buckets are bounded, the oldest perceptual hashes are dropped first
+    cache.set(ImageBlob(path="d.jpg", sha256="d", phash="0000000000000100"), "prompt", "gpt-4o", "# D")
+    cache.set(ImageBlob(path="e.jpg", sha256="e", phash="0000000000000200"), "prompt", "gpt-4o", "# E")
+    assert cache.get(ImageBlob(path="b.jpg", sha256="b", phash="000000000000000f"), "prompt", "gpt-4o") is None
+    assert cache.get(ImageBlob(path="f.jpg", sha256="f", phash="0000000000000300"), "prompt", "gpt-4o") == "# D"
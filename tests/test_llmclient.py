@@ -0,0 +1,111 @@
+import time
+import asyncio
+import httpx
+import openai
+import orjson
+import pytest
+from types import SimpleNamespace
+from tenacity import RetryCallState
+from core import LLMClient
+
+def make_error(error_class, status_code, headers=None):
+    response = httpx.Response(status_code, headers=headers, request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+    return error_class("error", response=response, body=None)
+
+def make_retry_state(error):
+    retry_state = RetryCallState(retry_object=None, fn=None, args=(), kwargs={})
+    retry_state.set_exception((type(error), error, None))
+    return retry_state
+
+def test_wait_retry_after():
+    assert LLMClient.wait_retry_after(make_retry_state(make_error(openai.RateLimitError, 429, {"retry-after": "20"}))) >= 20
+    assert LLMClient.wait_retry_after(make_retry_state(make_error(openai.RateLimitError, 429, {"retry-after": "3600"}))) == LLMClient.MAX_RETRY_WAIT
+    assert LLMClient.wait_retry_after(make_retry_state(make_error(openai.RateLimitError, 429, {"retry-after": "soon"}))) <= 2
+    assert LLMClient.wait_retry_after(make_retry_state(make_error(openai.RateLimitError, 429))) <= 2
+
+@pytest.mark.parametrize("error, attempts", [
+    (make_error(openai.RateLimitError, 429), 3),
+    (make_error(openai.AuthenticationError, 401), 1),
+    (make_error(openai.BadRequestError, 400), 1),
+])
+def test_completion_retry(monkeypatch, error, attempts):
+    monkeypatch.setattr(LLMClient, "wait_retry_after", lambda retry_state: 0)
+    client = LLMClient.LLMClient(base_url="https://api.openai.com/v1/", api_key="sk-test", model="gpt-4o")
+    calls = []
+
+    async def create(**kwargs):
+        calls.append(kwargs)
+        raise error
+
+    monkeypatch.setattr(client.client.chat.completions, "create", create)
+    with pytest.raises(type(error)):
+        asyncio.run(client.completion(user_message="Hello, world!", retry_times=3))
+    assert len(calls) == attempts
+
+@pytest.mark.parametrize("system_prompt, system_messages", [
+    (None, []),
+    ("", []),
+    ("You are a helpful assistant.", [{"role": "system", "content": "You are a helpful assistant."}]),
+])
+def test_completion_system_prompt(monkeypatch, system_prompt, system_messages):
+    client = LLMClient.LLMClient(base_url="https://api.openai.com/v1/", api_key="sk-test", model="gpt-4o")
+    calls = []
+
+    async def create(**kwargs):
+        calls.append(kwargs)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="# Hello"))])
+
+    monkeypatch.setattr(client.client.chat.completions, "create", create)
+    assert asyncio.run(client.completion(user_message="Hello, world!", system_prompt=system_prompt)) == "# Hello"
+    assert len(calls) == 1
+    # The system message is only sent when there is a system prompt
+    assert [message for message in calls[0]["messages"] if message["role"] == "system"] == system_messages
+    assert calls[0]["messages"][-1]["role"] == "user"
+
+def test_completion_deadline(monkeypatch):
+    client = LLMClient.LLMClient(base_url="https://api.openai.com/v1/", api_key="sk-test", model="gpt-4o")
+
+    async def create(**kwargs):
+        raise make_error(openai.RateLimitError, 429, {"retry-after": "20"})
+
+    monkeypatch.setattr(client.client.chat.completions, "create", create)
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        asyncio.run(client.completion(user_message="Hello, world!", retry_times=3, deadline=start + 0.2))
+    assert time.monotonic() - start < 2
+
+def test_completion_request_body(monkeypatch):
+    requests = []
+    dumped = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, json={
+            "id": "chatcmpl-test",
+            "object": "chat.completion",
+            "created": 0,
+            "model": "gpt-4o",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "# Hello"}, "finish_reason": "stop"}],
+        })
+
+    class MockHttpxClient(LLMClient.OrjsonAsyncHttpxClient):
+        def __init__(self, **kwargs):
+            super().__init__(transport=httpx.MockTransport(handler), **kwargs)
+
+    dumps = orjson.dumps
+
+    def spy_dumps(obj, *args, **kwargs):
+        dumped.append(dumps(obj, *args, **kwargs))
+        return dumped[-1]
+
+    monkeypatch.setattr(LLMClient, "OrjsonAsyncHttpxClient", MockHttpxClient)
+    monkeypatch.setattr(orjson, "dumps", spy_dumps)
+    client = LLMClient.LLMClient(base_url="https://api.openai.com/v1/", api_key="sk-test", model="gpt-4o")
+    assert asyncio.run(client.completion(user_message="Hello, world!")) == "# Hello"
+    assert len(requests) == 1
+    assert requests[0].headers["content-type"] == "application/json"
+    # The body is the orjson output sent as is
+    assert dumped == [requests[0].content]
+    body = orjson.loads(requests[0].content)
+    assert body["model"] == "gpt-4o"
+    assert body["messages"] == [{"role": "user", "content": [{"type": "text", "text": "Hello, world!"}]}]
@@ -0,0 +1,135 @@
+import io
+import pytest
+import asyncio
+import main
+from core import ImageBlob, LLMClient
+from core.FileWorker import FileWorker
+
+class FakeWorker(FileWorker):
+    def __init__(self, img_paths):
+        super().__init__("input.pdf")
+        self.img_paths = img_paths
+        self.first_page = 5
+
+    def convert_to_images(self):
+        return self.img_paths
+
+def test_convert_pages_to_markdown(tmp_path, monkeypatch):
+    img_paths = []
+    for i in range(1, 6):
+        img_path = tmp_path / f"page_{i:04d}.jpg"
+        img_path.write_bytes(f"page {i}".encode())
+        img_paths.append(str(img_path))
+    monkeypatch.setattr(ImageBlob, "resize_image", lambda image_path: image_path)
+    monkeypatch.setenv("MARKPDF_BATCH_SIZE", "2")
+
+    async def convert_image_to_markdown(images, deadline=None, semaphore=None):
+        # Later batches finish first, page 4 fails
+        await asyncio.sleep(0.1 / int(images[0].path[-6:-4]))
+        return [None if image.path.endswith("page_0004.jpg") else f"# {image.path[-13:-4]}" for image in images]
+
+    monkeypatch.setattr(main, "convert_image_to_markdown", convert_image_to_markdown)
+    output = io.StringIO()
+    assert asyncio.run(main.convert_pages_to_markdown(FakeWorker(img_paths), output)) == 5
+    assert output.getvalue() == "# page_0001\n\n# page_0002\n\n# page_0003\n\n<!-- page 8 failed -->\n\n# page_0005\n\n"
+
+def test_convert_pages_to_markdown_render_failure(tmp_path, monkeypatch):
+    img_paths = []
+    for i in range(1, 6):
+        img_path = tmp_path / f"page_{i:04d}.jpg"
+        img_path.write_bytes(f"page {i}".encode())
+        img_paths.append(str(img_path))
+    # Page 2 cannot be read, page 3 cannot be resized
+    img_paths[1] = str(tmp_path / "page_0002_missing.jpg")
+
+    def resize_image(image_path):
+        if image_path.endswith("page_0003.jpg"):
+            raise RuntimeError("cannot resize")
+        return image_path
+
+    monkeypatch.setattr(ImageBlob, "resize_image", resize_image)
+    monkeypatch.setenv("MARKPDF_BATCH_SIZE", "2")
+
+    async def convert_image_to_markdown(images, deadline=None, semaphore=None):
+        return [f"# {image.upload_path[-13:-4]}" for image in images]
+
+    monkeypatch.setattr(main, "convert_image_to_markdown", convert_image_to_markdown)
+    output = io.StringIO()
+    assert asyncio.run(main.convert_pages_to_markdown(FakeWorker(img_paths), output)) == 5
+    assert output.getvalue() == "# page_0001\n\n<!-- page 6 failed -->\n\n# page_0003\n\n# page_0004\n\n# page_0005\n\n"
+
+def test_convert_pages_to_markdown_batch_failure(tmp_path, monkeypatch):
+    img_paths = []
+    for i in range(1, 6):
+        img_path = tmp_path / f"page_{i:04d}.jpg"
+        img_path.write_bytes(f"page {i}".encode())
+        img_paths.append(str(img_path))
+    monkeypatch.setattr(ImageBlob, "resize_image", lambda image_path: image_path)
+    monkeypatch.setenv("MARKPDF_BATCH_SIZE", "2")
+    converted = []
+
+    async def convert_image_to_markdown(images, deadline=None, semaphore=None):
+        await asyncio.sleep(0.01 * int(images[0].path[-6:-4]))
+        if images[0].path.endswith("page_0003.jpg"):
+            raise RuntimeError("batch failed")
+        converted.extend(image.path for image in images)
+        return [f"# {image.path[-13:-4]}" for image in images]
+
+    monkeypatch.setattr(main, "convert_image_to_markdown", convert_image_to_markdown)
+    output = io.StringIO()
+    assert asyncio.run(main.convert_pages_to_markdown(FakeWorker(img_paths), output)) == 5
+    assert output.getvalue() == "# page_0001\n\n# page_0002\n\n<!-- page 7 failed -->\n\n<!-- page 8 failed -->\n\n# page_0005\n\n"
+
+    # Batches still in flight are cancelled when the output fails
+    class FailingOutput(io.StringIO):
+        def write(self, s):
+            raise OSError("broken pipe")
+
+    converted.clear()
+    with pytest.raises(OSError):
+        asyncio.run(main.convert_pages_to_markdown(FakeWorker(img_paths), FailingOutput()))
+    assert converted == img_paths[:2]
+
+def test_convert_pages_to_markdown_unrendered_pages(tmp_path, monkeypatch):
+    img_paths = []
+    for i in range(1, 4):
+        img_path = tmp_path / f"page_{i:04d}.jpg"
+        img_path.write_bytes(f"page {i}".encode())
+        img_paths.append(str(img_path))
+
+    class TruncatedWorker(FakeWorker):
+        def iter_pages(self, **kwargs):
+            # Pages 2, 4 and 5 failed to render
+            yield from [self.img_paths[0], None, self.img_paths[2], None, None]
+
+    monkeypatch.setattr(ImageBlob, "resize_image", lambda image_path: image_path)
+    monkeypatch.setenv("MARKPDF_BATCH_SIZE", "2")
+
+    async def convert_image_to_markdown(images, deadline=None, semaphore=None):
+        return [f"# {image.path[-13:-4]}" for image in images]
+
+    monkeypatch.setattr(main, "convert_image_to_markdown", convert_image_to_markdown)
+    output = io.StringIO()
+    assert asyncio.run(main.convert_pages_to_markdown(TruncatedWorker(img_paths), output)) == 5
+    assert output.getvalue() == "# page_0001\n\n<!-- page 6 failed -->\n\n# page_0003\n\n<!-- page 8 failed -->\n\n<!-- page 9 failed -->\n\n"
+
+def test_get_client(monkeypatch):
+    closed = []
+
+    async def close(self):
+        closed.append(self)
+
+    monkeypatch.setattr(LLMClient.LLMClient, "close", close)
+
+    async def run():
+        client = main.get_client("https://api.openai.com/v1/", "sk-test", "gpt-4o")
+        assert main.get_client("https://api.openai.com/v1/", "sk-test", "gpt-4o") is client
+        await main.close_clients()
+        return client
+
+    # Clients are not shared across event loops and are closed with them
+    first = asyncio.run(run())
+    second = asyncio.run(run())
+    assert first is not second
+    assert closed == [first, second]
+    assert main.clients == {}
@@ -8,3 +8,27 @@ def test_remove_markdown_warp():
     assert remove_markdown_warp("\nHello, world!\n\`\`\`text\nHi, world!\n\`\`\`\n", "markdown") == "Hello, world!\n\`\`\`text\nHi, world!\n\`\`\`"
     assert remove_markdown_warp("```python\nprint('Hello, world!')\n```", "python") == "print('Hello, world!')"
     assert remove_markdown_warp("```bash\nls -l\n```", "bash") == "ls -l"
+
+def test_detect_file_type():
+    assert detect_file_type(b"%PDF-1.7\n") == (".pdf", "PDF")
+    assert detect_file_type(b"\xFF\xD8\xFF\xDB\x00\x84") == (".jpg", "JPEG")
+    assert detect_file_type(b"\xFF\xD8\xFF\xE0\x00\x10JFIF") == (".jpg", "JPEG")
+    assert detect_file_type(b"\x89PNG\r\n\x1a\n") == (".png", "PNG")
+    assert detect_file_type(b"BM\x36\x00") == (".bmp", "BMP")
+    assert detect_file_type(b"GIF89a") == (None, None)
+    assert detect_file_type(b"") == (None, None)
+
+def test_split_batch_markdown():
+    assert split_batch_markdown("<page 1>\n# Hello\n</page 1>\n<page 2>\nworld!\n</page 2>", 2) == ["# Hello", "world!"]
+    assert split_batch_markdown("<page 1>```markdown\nHi\n```</page 1>", 1) == ["```markdown\nHi\n```"]
+    assert split_batch_markdown("<page 1>\n# Hello\n</page 1>", 2) == ["# Hello", None]
+    assert split_batch_markdown("<page 1>\n# Hello\n</page 1>\n<page 2>\nwor", 2) == ["# Hello", None]
+    assert split_batch_markdown("<page 2>\nworld!\n</page 2>", 2) == [None, "world!"]
+    assert split_batch_markdown("# Hello\n\nworld!", 2) == [None, None]
+    assert split_batch_markdown("", 2) == [None, None]
+
+def test_natural_sort_key():
+    assert sorted(["page-10.png", "page-2.png", "page-1.png"], key=natural_sort_key) == ["page-1.png", "page-2.png", "page-10.png"]
+    assert sorted(["out/page_0010.jpg", "out/page_0002.jpg"], key=natural_sort_key) == ["out/page_0002.jpg", "out/page_0010.jpg"]
+    assert sorted(["scan_1_page_10.png", "scan_1_page_9.png", "scan_2_page_1.png"], key=natural_sort_key) == ["scan_1_page_9.png", "scan_1_page_10.png", "scan_2_page_1.png"]
+    assert sorted(["input.jpg"], key=natural_sort_key) == ["input.jpg"]